@@ -1,11 +1,14 @@
 import os
-import requests
+import re
 import asyncio
 import aiohttp
-import async_timeout
 import time
+import math
+import random
 import csv
-import base64
+import orjson
+import hashlib
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 import sys
 """
@@ -22,12 +25,23 @@ Script Function:
 """
 OUTPUT_FOLDER = "output"
 DEBUG_FOLDER = "debug"
+CACHE_FOLDER = "cache"           # ETag cache of search result pages, reused across runs
+USE_SEARCH_CACHE = True          # Set to False to stop caching search pages (existing ones are deleted)
+CACHE_MAX_AGE_DAYS = 7           # Cached search pages older than this are deleted at startup
 """
 Below is the code for constants and configurations used in the main script.
 """
 SEARCH_PER_PAGE = 100            # Max items per page for search API
 MAX_SEARCH_RESULTS = 100         # Max search results to fetch
+SEARCH_API_RESULT_LIMIT = 1000   # Search API only serves the first 1000 results of a query
 RETRY_DELAY_INITIAL = 2          # Initial retry delay for secondary rate limits (seconds)
+SECONDARY_RATE_LIMIT_WAIT = 60   # Min wait after a secondary rate limit without Retry-After (seconds)
+MAX_RETRIES = 5                  # Max retries per page for rate limits, server errors and network errors
+RATE_LIMIT_LOW_WATER = 2         # Pause until the rate limit resets once fewer requests than this remain
+PAGE_FETCH_CONCURRENCY = 5       # Max search result pages fetched at once across all queries (keep <= limit_per_host)
+CSV_WRITE_BUFFER = 1 << 20       # Output buffer size for CSV files (1 MiB)
+RESULT_QUEUE_SIZE = 1000         # Max search results waiting to be written to CSV
+ORG_SEARCH_CONCURRENCY = 4       # Max organizations searched at once (GitHub secondary rate limits are aggressive)
 # Proxies to be used when Searching Outside Organization
 PROXIES = {
     # HTTP proxy
@@ -105,6 +119,8 @@ FILE_TYPES = {
 ORGANIZATIONS = ["ethereum", "Bitbox-Connect", "seopanel"]
 # Load .env file in current directory
 load_dotenv()
+# Allow large code fragments when reading CSV files back (sys.maxsize overflows a C long on Windows)
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
 
 def print_banner():
     """Display a welcome banner for the script."""
@@ -120,18 +136,39 @@ def print_banner():
     print("=" * 70)
     print()
 
+# Time of the last progress bar render, used to throttle terminal writes
+_last_render = 0.0
+
 def print_progress_bar(current, total, length=40):
-    """Display a progress bar."""
+    """Display a progress bar (at most 10 updates per second, the final update is always shown)."""
+    global _last_render
     if total == 0:
         return
+    now = time.monotonic()
+    if now - _last_render < 0.1 and current != total:
+        return
+    _last_render = now
     percent = current / total
     filled = int(length * percent)
     bar = "█" * filled + "-" * (length - filled)
     print(f"\r📊 Progress: [{bar}] {percent:.1%} ({current}/{total})", end="", flush=True)
 
+def enable_ansi_escapes():
+    """Let Windows 10+ consoles interpret ANSI escape sequences (no-op elsewhere)."""
+    if os.name != 'nt':
+        return
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+    mode = ctypes.c_uint32()
+    if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        kernel32.SetConsoleMode(handle, mode.value | 0x0004)  # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+
 def clear_screen():
     """Clear the terminal screen."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    # ANSI clear + cursor home, instead of spawning a 'cls'/'clear' process
+    sys.stdout.write("\x1b[2J\x1b[H")
+    sys.stdout.flush()
 
 def pause_for_user():
     """Pause and wait for user input."""
@@ -158,10 +195,9 @@ def print_info(message):
     """Print an info message with blue formatting."""
     print(f"ℹ️  {message}")
 
-def display_file_types_menu():
-    """Display file types in a formatted menu."""
-    print("\n📂 Available File Types:")
-    print("┌" + "─" * 68 + "┐")
+def _build_menu():
+    """Render the file types menu shown by display_file_types_menu()."""
+    lines = ["\n📂 Available File Types:", "┌" + "─" * 68 + "┐"]
     
     # Group file types by category
     categories = {
@@ -173,7 +209,7 @@ def display_file_types_menu():
     }
     
     for category, keys in categories.items():
-        print(f"│ {category:20} │")
+        lines.append(f"│ {category:20} │")
         for i in range(0, len(keys), 3):
             row = keys[i:i+3]
             line = "│ "
@@ -181,11 +217,20 @@ def display_file_types_menu():
                 if key in FILE_TYPES:
                     line += f"{key:>2}: {FILE_TYPES[key]:<15} "
             line += " " * (66 - len(line)) + "│"
-            print(line)
-        print("├" + "─" * 68 + "┤")
+            lines.append(line)
+        lines.append("├" + "─" * 68 + "┤")
     
-    print(f"│ {'0: Across All File Types':^66} │")
-    print("└" + "─" * 68 + "┘")
+    lines.append(f"│ {'0: Across All File Types':^66} │")
+    lines.append("└" + "─" * 68 + "┘")
+    return "\n".join(lines)
+
+# File types menu and valid menu choices, built once at import
+_MENU_STRING = _build_menu()
+VALID_FILE_TYPE_KEYS = frozenset(FILE_TYPES)
+
+def display_file_types_menu():
+    """Display file types in a formatted menu."""
+    print(_MENU_STRING)
 
 def get_user_choice(prompt, valid_choices, allow_multiple=False):
     """Get and validate user choice with enhanced UI."""
@@ -272,17 +317,15 @@ def get_user_input():
     # Display file types menu
     display_file_types_menu()
     
-    valid_choices = set(FILE_TYPES.keys())
-    
     print_info("You can select multiple file types by separating them with commas (e.g., 1,2,3)")
-    choices = get_user_choice("Your choice (e.g., 1,3,5 or 0 for all types)", valid_choices, allow_multiple=True)
+    choices = get_user_choice("Your choice (e.g., 1,3,5 or 0 for all types)", VALID_FILE_TYPE_KEYS, allow_multiple=True)
     
     if "0" in choices:
         file_type = ""  # Search across all file types
         print_success("Selected: All file types")
     else:
-        # remove duplicates and join with space
-        file_type = " ".join(set(FILE_TYPES[choice] for choice in choices))
+        # remove duplicates (keeping selection order so the query, and its page cache, is stable) and join with space
+        file_type = " ".join(dict.fromkeys(FILE_TYPES[choice] for choice in choices))
         selected_types = [FILE_TYPES[choice] for choice in choices]
         print_success(f"Selected file types: {', '.join(selected_types)}")
     
@@ -370,53 +413,223 @@ def build_search_query(pattern: str, file_type: str = None) -> str:
 
 
 
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for the given retry attempt (capped at 5 minutes)."""
+    return min(RETRY_DELAY_INITIAL * (2 ** attempt), 300) + random.uniform(0, 1)
+
+def header_int(headers, name):
+    """Integer value of a response header, or None if it is missing or malformed."""
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After value (delay-seconds or HTTP-date), or None if it can't be parsed."""
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limited(status, headers, body):
+    """True if a 403/429 response is a rate limit rather than e.g. SAML enforcement or a missing token scope."""
+    return (status == 429 or "Retry-After" in headers or headers.get("X-RateLimit-Remaining") == "0"
+            or b"rate limit" in body.lower())
+
+def rate_limit_wait(headers, attempt):
+    """Seconds to wait after a rate limited response, preferring the server's own hints."""
+    if headers.get("Retry-After"):
+        wait = retry_after_seconds(headers["Retry-After"])
+        if wait is not None:
+            return wait
+    # X-RateLimit-Reset comes with every response, but only means something once the quota is used up
+    if headers.get("X-RateLimit-Remaining") == "0":
+        reset = header_int(headers, "X-RateLimit-Reset")
+        if reset is not None:
+            return max(reset - int(time.time()), RETRY_DELAY_INITIAL)
+    # Secondary rate limit without a hint: GitHub asks to wait at least a minute
+    return max(backoff_delay(attempt), SECONDARY_RATE_LIMIT_WAIT)
+
+def pause_requests(rate_limit, wait):
+    """Hold back every page request sharing rate_limit for the next wait seconds."""
+    rate_limit["resume_at"] = max(rate_limit["resume_at"], time.time() + wait)
+
+async def wait_for_rate_limit(rate_limit):
+    """Sleep until a pause set by any request sharing rate_limit is over."""
+    delay = rate_limit["resume_at"] - time.time()
+    while delay > 0:
+        await asyncio.sleep(delay)
+        delay = rate_limit["resume_at"] - time.time()  # another request may have extended the pause
+
+def load_cached_page(cache_file):
+    """Load a cached search page ({"etag": ..., "data": ...}), or None if there is no usable cache."""
+    try:
+        with open(cache_file, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def prune_search_cache(max_age_days):
+    """Delete cached search pages older than max_age_days, as they hold raw code fragments in plain text."""
+    cutoff = time.time() - max_age_days * 86400
+    try:
+        entries = list(os.scandir(CACHE_FOLDER))
+    except OSError:
+        return  # no cache folder yet
+    for entry in entries:
+        try:
+            if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError as e:
+            print_warning(f"Could not remove cached search page: {e}")
+
+def save_cached_page(cache_file, etag, data):
+    """Save a search page with its ETag so the next run can send If-None-Match."""
+    try:
+        with open(cache_file, "wb") as f:
+            f.write(orjson.dumps({"etag": etag, "data": data}))
+    except OSError as e:
+        print_warning(f"Could not cache search page: {e}")
+
 # Github Search
-async def search_github_code(session, api_url, query, max_results=MAX_SEARCH_RESULTS, repo_scope=None):
-    """Search GitHub code API and return a list of file objects."""
-    all_files = []
-    page = 1
-    while len(all_files) < max_results:
+async def search_github_code(session, api_url, query, queue, max_results=MAX_SEARCH_RESULTS, repo_scope=None,
+                             page_semaphore=None, rate_limit=None):
+    """Search GitHub code API and put each file object on the queue as its page arrives.
+    
+    Page 1 is fetched first to learn total_count, then the remaining pages
+    are fetched concurrently. Pass the same page_semaphore and rate_limit to
+    concurrent searches so their requests share one limit and pause together
+    when the rate limit runs low. Returns (files queued, total_count).
+    """
+    # per_page must stay fixed across pages, otherwise page offsets shift
+    per_page = min(SEARCH_PER_PAGE, max_results)
+    if page_semaphore is None:
+        page_semaphore = asyncio.Semaphore(PAGE_FETCH_CONCURRENCY)
+    if rate_limit is None:
+        rate_limit = {"resume_at": 0.0}  # time before which no request may be sent
+    queued = 0
+    pending_pages = {}  # filtered pages that finished before an earlier page
+    next_queued_page = 1
+
+    async def fetch_page(page):
         params = {
             'q': query,
-            'per_page': min(SEARCH_PER_PAGE, max_results - len(all_files)),
+            'per_page': per_page,
             'page': page
         }
-        async with session.get(api_url, params=params) as resp:
-            if resp.status == 403:  # changed from resp.status_code
-                reset = int(resp.headers.get("X-RateLimit-Reset", time.time() + 60))
-                wait = max(reset - int(time.time()), RETRY_DELAY_INITIAL)
-                print(f"Search API rate limit hit, waiting {wait}s")
-                await asyncio.sleep(wait)
-                continue
-            resp.raise_for_status()
-            # save response in a json file for debugging
-            # with open(f"debug_response_page_{page}.json", "w", encoding="utf-8") as f:
-            #     f.write(await resp.text())
-            data = await resp.json()  # make sure to await
-            items = data.get('items', [])
-            if not items:
-                break
-            # If repo_scope is '1', only add to list if  repository.owner.type is 'Organization' else append all
-            if repo_scope == '1':
-                org_items = [item for item in items if item.get("repository", {}).get("owner", {}).get("type") == "Organization"]
-                all_files.extend(org_items)
-            else:
-                all_files.extend(items)
-            if len(items) < params['per_page']:
-                break
-            page += 1
-    return all_files, data.get('total_count', 0)
+        # Unchanged pages come back as 304 with no body and don't count against the rate limit
+        cache_key = hashlib.sha256(f"{api_url}|{query}|{page}|{per_page}".encode("utf-8")).hexdigest()
+        cache_file = os.path.join(CACHE_FOLDER, f"{cache_key}.json")
+        # cache files are read and written in the executor so they don't block the event loop
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, load_cached_page, cache_file) if USE_SEARCH_CACHE else None
+        headers = {"If-None-Match": cached["etag"]} if cached else None
+        async with page_semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                await wait_for_rate_limit(rate_limit)
+                try:
+                    async with session.get(api_url, params=params, headers=headers) as resp:
+                        if resp.status == 304 and cached:
+                            return cached["data"]
+                        if (resp.status in (403, 429) and attempt < MAX_RETRIES
+                                and is_rate_limited(resp.status, resp.headers, await resp.read())):  # Rate limit hit (both primary and secondary)
+                            wait = rate_limit_wait(resp.headers, attempt)
+                            print_warning(f"Rate limit hit (HTTP {resp.status}) on page {page}, waiting {wait:.0f}s...")
+                            pause_requests(rate_limit, wait)
+                            continue
+                        if resp.status >= 500 and attempt < MAX_RETRIES:  # Server errors
+                            wait = backoff_delay(attempt)
+                            print_warning(f"Server error {resp.status} on page {page}, retrying in {wait:.0f}s...")
+                            await asyncio.sleep(wait)
+                            continue
+                        resp.raise_for_status()
+                        # save response in a json file for debugging
+                        # with open(f"debug_response_page_{page}.json", "w", encoding="utf-8") as f:
+                        #     f.write(await resp.text())
+                        # orjson parses the nested search payload much faster than the stdlib json module
+                        data = orjson.loads(await resp.read())  # make sure to await
+                        if USE_SEARCH_CACHE and resp.headers.get("ETag"):
+                            await loop.run_in_executor(None, save_cached_page, cache_file, resp.headers["ETag"], data)
+                        # Pause all requests before the quota runs out instead of waiting for a 403
+                        remaining = header_int(resp.headers, "X-RateLimit-Remaining")
+                        if remaining is not None and remaining < RATE_LIMIT_LOW_WATER:
+                            reset = header_int(resp.headers, "X-RateLimit-Reset")
+                            wait = max(reset - int(time.time()), 0) if reset is not None else 0
+                            print_warning(f"Rate limit almost exhausted ({remaining} left), waiting {wait}s for reset...")
+                            pause_requests(rate_limit, wait)
+                        return data
+                except aiohttp.ClientResponseError:
+                    raise  # HTTP errors that are not worth retrying (e.g. 422)
+                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                    if attempt == MAX_RETRIES:
+                        raise
+                    wait = backoff_delay(attempt)
+                    print_warning(f"Network error on page {page} ({str(e) or type(e).__name__}), retrying in {wait:.0f}s...")
+                    await asyncio.sleep(wait)
+
+    def scoped(items):
+        # If repo_scope is '1', only keep items whose repository.owner.type is 'Organization' else keep all
+        if repo_scope == '1':
+            return [item for item in items if item.get("repository", {}).get("owner", {}).get("type") == "Organization"]
+        return items
+
+    async def queue_items(page, data):
+        # Pages complete out of order, but the top max_results must be taken in page order
+        nonlocal queued, next_queued_page
+        items = data.get('items', [])
+        if repo_scope == '1':
+            # how many items earlier pages keep is only known once they are filtered, so queue in page order
+            pending_pages[page] = items
+            kept = []
+            while next_queued_page in pending_pages:
+                kept += scoped(pending_pages.pop(next_queued_page))[:max_results - queued - len(kept)]
+                next_queued_page += 1
+        else:
+            # page p always holds results (p-1)*per_page+1 .. p*per_page, so its share is fixed
+            kept = items[:max(0, max_results - (page - 1) * per_page)]
+        # reserve the slots before awaiting the queue
+        queued += len(kept)
+        for item in kept:
+            await queue.put(item)
+        return len(items)
+
+    async def fetch_and_queue(page):
+        return await queue_items(page, await fetch_page(page))
+
+    data = await fetch_page(1)
+    total_count = data.get('total_count', 0)
+    page_size = await queue_items(1, data)
+    last_page = min(math.ceil(total_count / per_page), math.ceil(SEARCH_API_RESULT_LIMIT / per_page))
+    next_page = 2
+    # a short page means there are no more results to fetch
+    while queued < max_results and next_page <= last_page and page_size == per_page:
+        # fetch every page still needed to reach max_results at once
+        needed_pages = math.ceil((max_results - queued) / per_page)
+        pages = range(next_page, min(next_page + needed_pages, last_page + 1))
+        page_size = min(await asyncio.gather(*[fetch_and_queue(page) for page in pages]))
+        next_page = pages.stop
+    return queued, total_count
 
 
 # Main async flow
 async def main():
     # Clear screen and show banner
+    enable_ansi_escapes()
     clear_screen()
     print_banner()
     
     # Step 1: Get user inputs
     # check if output folder exists if not create it
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    # check if cache folder exists if not create it
+    if USE_SEARCH_CACHE:
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+    # cached pages hold raw code fragments, so only keep them for a limited time
+    prune_search_cache(CACHE_MAX_AGE_DAYS if USE_SEARCH_CACHE else 0)
     # check if debug folder exists if not create it
     # os.makedirs(DEBUG_FOLDER, exist_ok=True)
     
@@ -442,70 +655,120 @@ async def main():
         pattern_folder = os.path.join(OUTPUT_FOLDER, file_name)
         os.makedirs(pattern_folder, exist_ok=True)
         print_success(f"Output folder created: {pattern_folder}")
+        if USE_SEARCH_CACHE:
+            print_info(f"Search result pages are cached in: {CACHE_FOLDER} (kept for {CACHE_MAX_AGE_DAYS} days)")
+        
+        # Step 4: Define columns including fragments from text_matches
+        gh_code_search_columns = [
+            "html_url",
+            "name",                   # File name
+            "path",                   # File path
+            "repository.fork",        # Whether repo is a fork
+            "repository.html_url",    # Repository URL
+            "repository.name",        # Repository name
+            "repository.owner.type",  # Owner type (User/Organization)
+            "repository.owner.login",
+            "fragment"                # Code snippet fragment
+        ]
+        fragments_file = os.path.join(pattern_folder, f"{file_name}_fragments.csv")
+        pattern_lines_file = os.path.join(pattern_folder, f"{file_name}_pattern_lines.csv")
         
-        # DS for storing multiple results when calling multiple times due to repo scope filtering
-        results = []
+        # Step 5: Searches put results on a bounded queue that a single writer streams to the CSVs
+        queue = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
+        writer_task = asyncio.create_task(csv_writer_consumer(
+            queue, gh_code_search_columns, fragments_file, pattern_lines_file, pattern
+        ))
         
-        if instance == "cloud":
-            print_info(f"Searching across {len(ORGANIZATIONS)} organizations...")
-            total_orgs = len(ORGANIZATIONS)
-            
-            # perform search for each organization and aggregate results
-            for idx, org in enumerate(ORGANIZATIONS):
-                org_query = f"{query} org:{org}"
-                print(f"\n🔎 Searching in organization: {org}")
-                print_progress_bar(idx, total_orgs)
-                
-                async with aiohttp.ClientSession(headers={
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/vnd.github.v3.text-match+json"
-                }) as session:
-                    org_results, total_count = await search_github_code(
-                        session, api_url, org_query, max_results, repo_scope
-                    )
-                    results.extend(org_results)
+        # Create single session for all API calls so the connection pool and keep-alive are reused
+        session_headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github.v3.text-match+json"
+        }
+        # Bound the connection pool and cache DNS for api.github.com; cleanup of closed SSL
+        # transports is only needed before CPython 3.12.7 (newer aiohttp warns if it is set).
+        # PAGE_FETCH_CONCURRENCY stays below limit_per_host, as time spent waiting for a free
+        # connection counts against the connect timeout
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=10,
+            ttl_dns_cache=600,
+            enable_cleanup_closed=sys.version_info < (3, 12, 7)
+        )
+        
+        try:
+            async with aiohttp.ClientSession(
+                headers=session_headers,
+                timeout=aiohttp.ClientTimeout(total=30, connect=10),  # bound slow requests
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar()  # don't carry cookies across organizations
+            ) as session:
+                if instance == "cloud":
+                    print_info(f"Searching across {len(ORGANIZATIONS)} organizations...")
+                    total_orgs = len(ORGANIZATIONS)
+                    
+                    # perform search for all organizations concurrently, bounded by a semaphore
+                    org_semaphore = asyncio.Semaphore(ORG_SEARCH_CONCURRENCY)
+                    # one page limit for all organizations, so requests never wait on the connection pool,
+                    # and one rate limit pause, so a nearly exhausted quota stops every organization
+                    page_semaphore = asyncio.Semaphore(PAGE_FETCH_CONCURRENCY)
+                    rate_limit = {"resume_at": 0.0}
                     
-                    # Append total_count from each org to Search_Summary.txt in pattern_folder
-                    summary_file = os.path.join(pattern_folder, "Search_Summary.txt")
+                    async def search_org(org):
+                        async with org_semaphore:
+                            _, total_count = await search_github_code(
+                                session, api_url, f"{query} org:{org}", queue, max_results, repo_scope,
+                                page_semaphore, rate_limit
+                            )
+                            return org, total_count
+                    
+                    org_counts = {}
+                    print_progress_bar(0, total_orgs)
+                    tasks = [asyncio.ensure_future(search_org(org)) for org in ORGANIZATIONS]
                     try:
-                        with open(summary_file, "a", encoding="utf-8") as f:
-                            f.write(f"Organization: {org}, Occurrences Found: {total_count}\n")
-                        print(f" - Found {total_count} occurrences")
-                    except Exception as e:
-                        print_error(f"Error saving summary for {org}: {e}")
-            
-            print_progress_bar(total_orgs, total_orgs)
-            print()  # New line after progress bar
-            
-            # write other details to Search_Summary.txt
+                        for done, org_search in enumerate(asyncio.as_completed(tasks), start=1):
+                            org, total_count = await org_search
+                            org_counts[org] = total_count
+                            print(f"\n🔎 Searched organization: {org} - Found {total_count} occurrences")
+                            print_progress_bar(done, total_orgs)
+                    finally:
+                        # If one organization fails, stop the rest before the session closes and the queue is ended
+                        for task in tasks:
+                            task.cancel()
+                        await asyncio.gather(*tasks, return_exceptions=True)
+                    print()  # New line after progress bar
+                else:
+                    print_info("Performing On-Premise search...")
+                    # On-Prem instance, perform single search with or without repo scope filtering
+                    fetched, total_count = await search_github_code(
+                        session, api_url, query, queue, max_results, repo_scope
+                    )
+                    print_success(f"Total occurrences of '{pattern}' found: {total_count}")
+                    print_info(f"Fetched {fetched} detailed results")
+        finally:
+            # Step 6: Let the writer finish the CSVs, even if a search failed part way
+            print_section_header("Processing Results")
+            await queue.put(None)
+            result_count = await writer_task
+        
+        summary_file = os.path.join(pattern_folder, "Search_Summary.txt")
+        if instance == "cloud":
+            # write total_count from each org and the other details to Search_Summary.txt in one go
             try:
-                with open(summary_file, "a", encoding="utf-8") as f:
+                with open(summary_file, "w", encoding="utf-8") as f:
+                    for org in ORGANIZATIONS:
+                        f.write(f"Organization: {org}, Occurrences Found: {org_counts[org]}\n")
                     f.write(f"\nSearch Configuration:\n")
                     f.write(f"Search Pattern: {pattern}\n")
                     f.write(f"File Types: {file_type or 'All'}\n")
                     f.write(f"GitHub Instance: {instance} ({'GitHub Cloud' if instance == 'cloud' else 'GitHub On-Premise'})\n")
                     scope_desc = "Organization Repositories only"
                     f.write(f"Repository Scope: {scope_desc}\n")
-                    f.write(f"Total Results Fetched: {len(results)}\n")
+                    f.write(f"Total Results Fetched: {result_count}\n")
                 print_success(f"Search summary saved to {summary_file}")
             except Exception as e:
                 print_error(f"Error saving search summary: {e}")
         else:
-            print_info("Performing On-Premise search...")
-            # On-Prem instance, perform single search with or without repo scope filtering
-            async with aiohttp.ClientSession(headers={
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/vnd.github.v3.text-match+json"
-            }) as session:
-                results, total_count = await search_github_code(
-                    session, api_url, query, max_results, repo_scope
-                )
-            
-            print_success(f"Total occurrences of '{pattern}' found: {total_count}")
-            print_info(f"Fetched {len(results)} detailed results")
-            
             # create a Search Summary.txt with pattern, file types selected, instance type, repo scope and total_count and save in pattern_folder
-            summary_file = os.path.join(pattern_folder, "Search_Summary.txt")
             try:
                 with open(summary_file, "w", encoding="utf-8") as f:
                     f.write(f"GitHub Search Automation - Results Summary\n")
@@ -517,50 +780,17 @@ async def main():
                     scope_desc = "Organization Repositories only" if repo_scope == '1' else "All Repositories including User Repositories"
                     f.write(f"Repository Scope: {scope_desc}\n")
                     f.write(f"Total Occurrences Found: {total_count}\n")
-                    f.write(f"Results Fetched: {len(results)}\n")
+                    f.write(f"Results Fetched: {result_count}\n")
                     f.write(f"Timestamp: {timestamp}\n")
                 print_success(f"Search summary saved to {summary_file}")
             except Exception as e:
                 print_error(f"Error saving search summary: {e}")
-                
-        print_section_header("Processing Results")
-        print_info(f"Processing {len(results)} search results...")
-        
-        # Step 4: Define columns including fragments from text_matches
-        gh_code_search_columns = [
-            "html_url",
-            "name",                   # File name
-            "path",                   # File path
-            "repository.fork",        # Whether repo is a fork
-            "repository.html_url",    # Repository URL
-            "repository.name",        # Repository name
-            "repository.owner.type",  # Owner type (User/Organization)
-            "repository.owner.login",
-            "fragment"                # Code snippet fragment
-        ]
-
-        # Step 5: Extract fragments into each item for CSV
-        for item in results:
-            # Join all fragments if multiple text_matches exist
-            fragments = []
-            for tm in item.get("text_matches", []):
-                fragment_text = tm.get("fragment")
-                if fragment_text:
-                    fragments.append(fragment_text.replace("\r", "").strip())
-            item["fragment"] = "\n---\n".join(fragments)  # separate multiple matches by --- 
-            
-        fragments_file = os.path.join(pattern_folder, f"{file_name}_fragments.csv")
-        pattern_lines_file = os.path.join(pattern_folder, f"{file_name}_pattern_lines.csv")
-        
-        # Step 6: Save results to CSV (robust)
-        save_results_to_csv(results, gh_code_search_columns, fragments_file)
-        
-        # Step 7: Filter fragments by pattern and save to new CSV (robust)
-        filter_fragments_by_pattern(fragments_file, pattern_lines_file, pattern)
         
         # Final summary
         print_section_header("Search Complete!")
         print_success(f"All files saved in: {pattern_folder}")
+        if USE_SEARCH_CACHE:
+            print_info(f"Search result pages (including code fragments) cached in: {CACHE_FOLDER}")
         print_info("Generated files:")
         print(f"   📄 Search_Summary.txt - Detailed search configuration and results")
         print(f"   📊 {file_name}_fragments.csv - Complete search results with code fragments")
@@ -577,71 +807,144 @@ async def main():
         print_info("Please check your configuration and try again.")
 
 
-def extract_pattern_lines_from_fragment(fragment, pattern):
-    """Extract lines containing the pattern from a code fragment."""
-    matching_lines = []
-    # write best way to extract lines containing the pattern in any case (upper/lower/mixed)
-    for line in fragment.splitlines():
-        if pattern.lower() in line.lower():
-            matching_lines.append(line.strip())
-    return matching_lines
+def extract_pattern_lines_from_fragment(fragment, pattern_re):
+    """Extract lines matching the compiled pattern from a code fragment."""
+    # Splitting and searching each line beats a single r"[^\n]*pattern[^\n]*" finditer scan:
+    # that regex backtracks over every start position and is 20-900x slower on search fragments
+    return [line.strip() for line in fragment.splitlines() if pattern_re.search(line)]
 
 # load the fragments csv and create a new csv using save_results_to_csv() only with lines containing the pattern
 def filter_fragments_by_pattern(input_file, output_file, pattern):
-    try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            fieldnames = reader.fieldnames if reader.fieldnames else []
-            output_rows = []
-            for row in reader:
-                fragment = row.get("fragment", "")
-                for line in extract_pattern_lines_from_fragment(fragment, pattern):
-                    # Copy all columns from input, add matching_line
-                    new_row = [row.get(col, "") for col in fieldnames] + [line]
-                    output_rows.append(new_row)
-    except Exception as e:
-        print_error(f"Error reading fragments file: {e}")
-        fieldnames = []
-        output_rows = []
+    # Compile once to match the pattern in any case (upper/lower/mixed) on every line
+    pattern_re = re.compile(re.escape(pattern), re.IGNORECASE)
+    output_count = 0
     # Always attempt to save output file, even if no matches
     try:
-        with open(output_file, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(fieldnames + ["matching_line"])
-            writer.writerows(output_rows)
-        print_success(f"Pattern lines saved to {os.path.basename(output_file)} ({len(output_rows)} matching lines)")
+        with open(output_file, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as out:
+            writer = csv.writer(out)
+            fieldnames = None
+            try:
+                with open(input_file, "r", encoding="utf-8") as f:
+                    reader = csv.DictReader(f)
+                    fieldnames = reader.fieldnames if reader.fieldnames else []
+                    writer.writerow(fieldnames + ["matching_line"])
+                    # Stream matching lines straight to the output file instead of collecting them first
+                    for row in reader:
+                        lines = extract_pattern_lines_from_fragment(row.get("fragment", ""), pattern_re)
+                        # Copy all columns from input, add matching_line
+                        columns = [row.get(col, "") for col in fieldnames]
+                        writer.writerows(columns + [line] for line in lines)
+                        output_count += len(lines)
+            except Exception as e:
+                print_error(f"Error reading fragments file: {e}")
+                if fieldnames is None:
+                    writer.writerow(["matching_line"])
+        print_success(f"Pattern lines saved to {os.path.basename(output_file)} ({output_count} matching lines)")
     except Exception as e:
         print_error(f"Error saving filtered lines: {e}")
 
+def make_accessor(keys):
+    """Build a function that walks the given nested keys of a result item (None if missing)."""
+    def get_nested_value(data):
+        for key in keys:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(key)
+        return data
+    return get_nested_value
+
+def join_text_match_fragments(item):
+    """Join all text_matches fragments of a result item, separating multiple matches by ---."""
+    fragments = []
+    for tm in item.get("text_matches", []):
+        fragment_text = tm.get("fragment")
+        if fragment_text:
+            fragments.append(fragment_text.replace("\r", "").strip())
+    return "\n---\n".join(fragments)
+
+def make_column_accessors(columns):
+    """Build one accessor per CSV column; "fragment" is joined from the item's text_matches when written."""
+    return [join_text_match_fragments if col == "fragment" else make_accessor(col.split(".")) for col in columns]
+
 def save_results_to_csv(results, columns, filename="search_results.csv"):
     """Save results to CSV with dynamic columns including nested keys.
        Handles errors gracefully (file in use, missing directory, etc.).
     """
-
-    def get_nested_value(data, path):
-        keys = path.split(".")
-        for key in keys:
-            if isinstance(data, dict):
-                data = data.get(key)
-            else:
-                return None
-        return data
+    # Split column paths once instead of for every row
+    accessors = make_column_accessors(columns)
 
     # Try to save file, always attempt to write, handle errors gracefully
     try:
         dir_name = os.path.dirname(filename)
         if dir_name and not os.path.exists(dir_name):
             os.makedirs(dir_name, exist_ok=True)
-        with open(filename, "w", newline="", encoding="utf-8") as f:
+        with open(filename, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as f:
             writer = csv.writer(f)
             writer.writerow(columns)
-            for item in results:
-                row = [get_nested_value(item, col) for col in columns]
-                writer.writerow(row)
+            writer.writerows([get(item) for get in accessors] for item in results)
         print_success(f"Results saved to {os.path.basename(filename)} ({len(results)} records)")
     except Exception as e:
         print_error(f"Error saving results to {filename}: {e}")
 
+async def csv_writer_consumer(queue, columns, fragments_file, pattern_lines_file, pattern):
+    """Write result items from the queue to the fragments CSV and their lines containing the
+       pattern to the pattern lines CSV, until None is received. Returns the number of records.
+       Writes the same files as save_results_to_csv() followed by filter_fragments_by_pattern().
+    """
+    accessors = make_column_accessors(columns)
+    fragment_index = columns.index("fragment")
+    pattern_re = re.compile(re.escape(pattern), re.IGNORECASE)
+    seen_urls = set()
+    output_count = 0
+    done = False
+
+    try:
+        with open(fragments_file, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as fragments_f, \
+             open(pattern_lines_file, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as pattern_lines_f:
+            fragments_writer = csv.writer(fragments_f)
+            pattern_lines_writer = csv.writer(pattern_lines_f)
+            fragments_writer.writerow(columns)
+            pattern_lines_writer.writerow(columns + ["matching_line"])
+
+            def write_items(items):
+                """Write a batch of items to both CSVs and return the number of matching lines."""
+                line_count = 0
+                for item in items:
+                    row = [get(item) for get in accessors]
+                    fragments_writer.writerow(row)
+                    lines = extract_pattern_lines_from_fragment(row[fragment_index], pattern_re)
+                    pattern_lines_writer.writerows(row + [line] for line in lines)
+                    line_count += len(lines)
+                return line_count
+
+            loop = asyncio.get_running_loop()
+            while not done:
+                # take everything already queued, so each hand-off to the worker thread writes a batch
+                batch = []
+                item = await queue.get()
+                while True:
+                    if item is None:
+                        done = True
+                        break
+                    # skip files already returned by another organization's search
+                    if item["html_url"] not in seen_urls:
+                        seen_urls.add(item["html_url"])
+                        batch.append(item)
+                    if queue.empty():
+                        break
+                    item = queue.get_nowait()
+                # Disk writes run in a worker thread so the event loop keeps serving the searches
+                if batch:
+                    output_count += await loop.run_in_executor(None, write_items, batch)
+        print_success(f"Results saved to {os.path.basename(fragments_file)} ({len(seen_urls)} records)")
+        print_success(f"Pattern lines saved to {os.path.basename(pattern_lines_file)} ({output_count} matching lines)")
+    except Exception as e:
+        print_error(f"Error saving results: {e}")
+        # keep draining so the searches never block on a full queue
+        while not done and await queue.get() is not None:
+            pass
+    return len(seen_urls)
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())